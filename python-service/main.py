@@ -5,14 +5,21 @@ FastAPI service for PDF processing with PyMuPDF.
 Handles template-based data injection into PDFs.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from pydantic import BaseModel, Field as PydanticField, TypeAdapter, ValidationError
+from typing import Any, Callable, Iterable, Optional
+import asyncio
 import io
+import os
+import zipfile
 
-from pdf_processor import PDFProcessor
+from pdf_processor import MAX_PDF_BYTES, PDFProcessor, PDFTooLargeError, check_pdf_size
 
 app = FastAPI(
     title="PDF Mapper API",
@@ -20,7 +27,60 @@ app = FastAPI(
     version="1.0.0",
 )
 
-# CORS configuration
+# Largest request body accepted: a base64-encoded MAX_PDF_BYTES PDF plus
+# room for the template, data and JSON/multipart framing
+MAX_BODY_BYTES = MAX_PDF_BYTES * 4 // 3 + 1024 * 1024
+
+# Most data records accepted in one batch request
+MAX_BATCH_RECORDS = int(os.environ.get("MAX_BATCH_RECORDS", 100))
+
+
+class LimitBodySizeMiddleware:
+    """
+    Reject request bodies over MAX_BODY_BYTES.
+    
+    Bodies that declare a larger Content-Length are refused before any of
+    them is read. Chunked bodies carry no length, so bytes are also counted
+    as the app receives them and the request fails once the limit is passed.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_BODY_BYTES:
+            response = JSONResponse(
+                status_code=413,
+                content={"detail": "Request body too large"},
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def receive_limited() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_BODY_BYTES:
+                    # HTTPException passes through FastAPI's body parsing
+                    # and is answered as a 413 by its exception handler
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+        
+        await self.app(scope, receive_limited, send)
+
+
+app.add_middleware(LimitBodySizeMiddleware)
+
+
+# CORS configuration (added last so it also wraps the size-limit responses)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -34,6 +94,20 @@ app.add_middleware(
 )
 
 
+# Shared processor; it keeps no per-document state, so one instance
+# serves every request
+_PROCESSOR = PDFProcessor()
+
+# PyMuPDF is not thread-safe, so PDF jobs run one at a time
+_PDF_LOCK = asyncio.Lock()
+
+
+async def _run_pdf_job(func: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Any:
+    """Run CPU-bound PyMuPDF work in the threadpool, off the event loop."""
+    async with _PDF_LOCK:
+        return await run_in_threadpool(func, *args, **kwargs)
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # DATA MODELS
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -70,6 +144,19 @@ class ProcessRequest(BaseModel):
     data: dict[str, str | bool | int | float | None]
 
 
+class BatchProcessRequest(BaseModel):
+    """Request to fill one PDF with several data records"""
+    pdf_base64: str  # Base64 encoded PDF
+    template: Template
+    data: list[dict[str, str | bool | int | float | None]] = PydanticField(
+        min_length=1, max_length=MAX_BATCH_RECORDS
+    )
+
+
+# Validates the JSON-encoded `data` form field of /process-pdf-raw
+_FORM_DATA = TypeAdapter(dict[str, str | bool | int | float | None])
+
+
 class HealthResponse(BaseModel):
     """Health check response"""
     status: str
@@ -87,8 +174,80 @@ async def health_check():
     return HealthResponse(status="healthy", version="1.0.0")
 
 
-@app.post("/process-pdf")
-async def process_pdf(request: ProcessRequest):
+async def _parse_json_body(http_request: Request, model: type[BaseModel]) -> Any:
+    """
+    Parse a request body with Pydantic's native JSON parser.
+    
+    Used instead of FastAPI's json.loads + validate, which is much slower
+    on multi-MB base64 payloads.
+    """
+    try:
+        return model.model_validate_json(await http_request.body())
+    except ValidationError as e:
+        raise _body_validation_error(e)
+
+
+def _body_validation_error(e: ValidationError, *loc: str) -> RequestValidationError:
+    """
+    Convert a Pydantic error on (part of) the request body to FastAPI's 422.
+    
+    Error locations are prefixed with ("body", *loc) to match FastAPI's;
+    inputs are left out so a bad multi-MB payload is not echoed back.
+    """
+    return RequestValidationError([
+        {**error, "loc": ("body", *loc, *error["loc"])}
+        for error in e.errors(include_url=False, include_input=False)
+    ])
+
+
+# Component schemas for the models behind _json_body_schema; FastAPI only
+# collects components for models it sees in endpoint signatures
+_JSON_BODY_COMPONENTS: dict[str, Any] = {}
+
+
+def _json_body_schema(model: type[BaseModel]) -> dict[str, Any]:
+    """OpenAPI request body for endpoints that parse JSON themselves."""
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    _JSON_BODY_COMPONENTS.update(schema.pop("$defs", {}))
+    _JSON_BODY_COMPONENTS[model.__name__] = schema
+    return {
+        "requestBody": {
+            "content": {
+                "application/json": {
+                    "schema": {"$ref": f"#/components/schemas/{model.__name__}"}
+                }
+            },
+            "required": True,
+        }
+    }
+
+
+def _openapi() -> dict[str, Any]:
+    """Generate the OpenAPI schema, adding the JSON body components."""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(
+            _JSON_BODY_COMPONENTS
+        )
+    return app.openapi_schema
+
+
+app.openapi = _openapi
+
+
+def _pdf_response(output_pdf: bytes, template_name: str) -> Response:
+    """Wrap a processed PDF as a downloadable response."""
+    return Response(
+        content=output_pdf,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f'attachment; filename="{template_name}_filled.pdf"'
+        }
+    )
+
+
+@app.post("/process-pdf", openapi_extra=_json_body_schema(ProcessRequest))
+async def process_pdf(http_request: Request):
     """
     Process a PDF template with injected data.
     
@@ -97,27 +256,69 @@ async def process_pdf(request: ProcessRequest):
     2. Iterate through template fields
     3. Calculate PDF coordinates from percentage positions
     4. Inject text/data at each field location
-    5. Return the processed PDF as binary stream
+    5. Return the processed PDF as binary
     """
+    request = await _parse_json_body(http_request, ProcessRequest)
+    
     try:
-        processor = PDFProcessor()
-        
-        # Process the PDF
-        output_pdf = processor.process(
+        # Process the PDF off the event loop; PyMuPDF work is CPU-bound
+        output_pdf = await _run_pdf_job(
+            _PROCESSOR.process,
             pdf_base64=request.pdf_base64,
             template=request.template,
             data=request.data,
         )
         
-        # Return as streaming response
-        return StreamingResponse(
-            io.BytesIO(output_pdf),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'attachment; filename="{request.template.name}_filled.pdf"'
-            }
+        # Return as a PDF download
+        return _pdf_response(output_pdf, request.template.name)
+        
+    except PDFTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error processing PDF: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process PDF")
+
+
+@app.post("/process-pdf-raw")
+async def process_pdf_raw(
+    pdf: UploadFile = File(...),
+    template: str = Form(...),
+    data: str = Form(...),
+):
+    """
+    Process an uploaded PDF with injected data.
+    
+    Same as /process-pdf, but takes the PDF as a multipart file upload
+    instead of base64, avoiding the encoding overhead. `template` and
+    `data` are JSON-encoded form fields.
+    """
+    try:
+        parsed_template = Template.model_validate_json(template)
+    except ValidationError as e:
+        raise _body_validation_error(e, "template")
+    try:
+        parsed_data = _FORM_DATA.validate_json(data)
+    except ValidationError as e:
+        raise _body_validation_error(e, "data")
+    
+    try:
+        # Reject oversized uploads before reading them into memory
+        if pdf.size is not None:
+            check_pdf_size(pdf.size)
+        
+        output_pdf = await _run_pdf_job(
+            _PROCESSOR.process_bytes,
+            pdf_bytes=await pdf.read(),
+            template=parsed_template,
+            data=parsed_data,
         )
         
+        return _pdf_response(output_pdf, parsed_template.name)
+        
+    except PDFTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -125,14 +326,62 @@ async def process_pdf(request: ProcessRequest):
         raise HTTPException(status_code=500, detail="Failed to process PDF")
 
 
+def _zip_outputs(outputs: Iterable[bytes], template_name: str) -> memoryview:
+    """Bundle processed PDFs into a zip archive, writing each as it arrives."""
+    buffer = io.BytesIO()
+    # PDFs are already compressed, so store them as-is
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for index, output_pdf in enumerate(outputs, start=1):
+            archive.writestr(f"{template_name}_{index}_filled.pdf", output_pdf)
+    # Hand out the archive without copying it
+    return buffer.getbuffer()
+
+
+@app.post("/process-pdf-batch", openapi_extra=_json_body_schema(BatchProcessRequest))
+async def process_pdf_batch(http_request: Request):
+    """
+    Fill one PDF template with several data records.
+    
+    The PDF is decoded once and reused for every record. Returns a zip
+    archive with one filled PDF per record, in request order.
+    """
+    request = await _parse_json_body(http_request, BatchProcessRequest)
+    
+    def fill_and_zip() -> memoryview:
+        outputs = _PROCESSOR.process_batch(
+            pdf_base64=request.pdf_base64,
+            template=request.template,
+            data_list=request.data,
+        )
+        return _zip_outputs(outputs, request.template.name)
+    
+    try:
+        archive = await _run_pdf_job(fill_and_zip)
+        
+        return Response(
+            content=archive,
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{request.template.name}_filled.zip"'
+            }
+        )
+        
+    except PDFTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error processing PDF batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process PDF batch")
+
+
 @app.post("/validate-pdf")
 async def validate_pdf(pdf_base64: str):
     """
     Validate a PDF and return page count.
     """
     try:
-        processor = PDFProcessor()
-        page_count = processor.get_page_count(pdf_base64)
+        page_count = await _run_pdf_job(_PROCESSOR.get_page_count, pdf_base64)
         return {"valid": True, "page_count": page_count}
     except Exception as e:
         return {"valid": False, "error": str(e)}
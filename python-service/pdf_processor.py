@@ -6,10 +6,90 @@ Handles coordinate conversion and text/data injection.
 """
 
 import base64
+import binascii
+import io
+import logging
+import os
+import sys
 import fitz  # PyMuPDF
-from typing import Any
+from collections import defaultdict
+from typing import Any, Iterator
 from datetime import datetime
 
+try:
+    # SIMD-accelerated base64 (AVX2/AVX-512/NEON); same output as stdlib
+    import pybase64 as _base64
+except ImportError:  # pragma: no cover - fallback when the wheel is unavailable
+    import base64 as _base64
+
+
+logger = logging.getLogger(__name__)
+
+# Errors the MuPDF bindings behind the incremental save can raise: missing
+# or changed internals, or a failure inside MuPDF itself
+_INCREMENTAL_SAVE_ERRORS = (AttributeError, TypeError, fitz.mupdf.FzErrorBase)
+
+# Largest PDF accepted, in decoded bytes
+MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_BYTES", 50 * 1024 * 1024))
+
+# Largest total output of one batch, in bytes; every filled PDF is at least
+# as large as the input, so this bounds PDF size times record count
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", 256 * 1024 * 1024))
+
+# datetime.fromisoformat() accepts a trailing "Z" from Python 3.11
+_ISO_PARSES_Z = sys.version_info >= (3, 11)
+
+# Base64 characters decoded per step (multiple of 4 so chunks stand alone)
+_B64_CHUNK = 64 * 1024
+
+
+class PDFTooLargeError(ValueError):
+    """Raised when a PDF exceeds MAX_PDF_BYTES or a batch MAX_BATCH_BYTES."""
+
+
+def check_pdf_size(size: int) -> None:
+    """Reject PDFs over MAX_PDF_BYTES before any decoding or parsing."""
+    if size > MAX_PDF_BYTES:
+        raise PDFTooLargeError(
+            f"PDF is {size} bytes; the maximum is {MAX_PDF_BYTES} bytes"
+        )
+
+
+def _b64decode(data: str) -> bytearray:
+    """
+    Decode a base64 payload, using pybase64 when available.
+    
+    Decoding a str in one call first copies the whole payload to ASCII
+    bytes. Working in fixed-size chunks caps that transient copy at
+    _B64_CHUNK and writes into a single pre-sized output buffer.
+    
+    Chunks are decoded strictly, which only accepts plain base64 with
+    padding at the very end. Anything else (line breaks, stray characters,
+    inner padding) is decoded again in one stdlib call so the result, or
+    the error, matches a plain b64decode exactly.
+    """
+    if not data.isascii():
+        return bytearray(base64.b64decode(data, validate=False))
+    
+    out = bytearray(len(data) * 3 // 4)
+    pos = 0
+    
+    try:
+        for start in range(0, len(data), _B64_CHUNK):
+            chunk = data[start:start + _B64_CHUNK]
+            if chunk[-1] == "=" and start + _B64_CHUNK < len(data):
+                # Padding before the end of the payload
+                raise binascii.Error("inner padding")
+            decoded = _base64.b64decode(chunk, validate=True)
+            out[pos:pos + len(decoded)] = decoded
+            pos += len(decoded)
+    except binascii.Error:
+        return bytearray(base64.b64decode(data, validate=False))
+    
+    # Trim the slack left by padding characters
+    del out[pos:]
+    return out
+
 
 class PDFProcessor:
     """
@@ -19,6 +99,14 @@ class PDFProcessor:
     This ensures consistent placement regardless of the viewer's zoom/DPI.
     """
     
+    # Fixed attribute layout: no per-instance dict, slot-indexed access in
+    # the per-field injectors
+    __slots__ = (
+        "font",
+        "fontsize",
+        "text_color",
+    )
+    
     # Default text settings
     DEFAULT_FONT = "helv"  # Helvetica
     DEFAULT_FONTSIZE = 11
@@ -39,12 +127,16 @@ class PDFProcessor:
         self.text_color = text_color
     
     def get_page_count(self, pdf_base64: str) -> int:
-        """Get the number of pages in a PDF."""
-        pdf_bytes = base64.b64decode(pdf_base64)
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        count = len(doc)
-        doc.close()
-        return count
+        """
+        Get the number of pages in a PDF.
+        
+        Opening only loads the xref; page_count then reads /Count from the
+        page tree root without loading any pages.
+        """
+        check_pdf_size(len(pdf_base64) * 3 // 4)
+        pdf_bytes = _b64decode(pdf_base64)
+        with fitz.open(stream=memoryview(pdf_bytes), filetype="pdf") as doc:
+            return doc.page_count
     
     def process(
         self,
@@ -53,7 +145,7 @@ class PDFProcessor:
         data: dict[str, Any],
     ) -> bytes:
         """
-        Process a PDF by injecting data at field locations.
+        Process a base64-encoded PDF by injecting data at field locations.
         
         Args:
             pdf_base64: Base64-encoded PDF binary
@@ -63,62 +155,218 @@ class PDFProcessor:
         Returns:
             Processed PDF as bytes
         """
-        # Decode PDF
-        pdf_bytes = base64.b64decode(pdf_base64)
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        check_pdf_size(len(pdf_base64) * 3 // 4)
+        return self.process_bytes(_b64decode(pdf_base64), template, data)
+    
+    def process_batch(
+        self,
+        pdf_base64: str,
+        template: Any,  # Template Pydantic model
+        data_list: list[dict[str, Any]],
+    ) -> Iterator[bytes]:
+        """
+        Process one base64-encoded PDF against several data records.
+        
+        The PDF is decoded once and every record is filled from the same
+        buffer, instead of re-sending and re-decoding it per record. Outputs
+        are produced one at a time so callers can hand each off before the
+        next is filled.
+        
+        Args:
+            pdf_base64: Base64-encoded PDF binary
+            template: Template object with field definitions
+            data_list: One field_key -> value dictionary per output PDF
+            
+        Yields:
+            Processed PDFs as bytes, in the order of data_list
+        """
+        pdf_size = len(pdf_base64) * 3 // 4
+        check_pdf_size(pdf_size)
+        batch_size = pdf_size * len(data_list)
+        if batch_size > MAX_BATCH_BYTES:
+            raise PDFTooLargeError(
+                f"Batch output would be at least {batch_size} bytes; "
+                f"the maximum is {MAX_BATCH_BYTES} bytes"
+            )
+        
+        pdf_bytes = _b64decode(pdf_base64)
+        for data in data_list:
+            yield self.process_bytes(pdf_bytes, template, data)
+    
+    def process_bytes(
+        self,
+        pdf_bytes: bytes | bytearray,
+        template: Any,  # Template Pydantic model
+        data: dict[str, Any],
+    ) -> bytes:
+        """
+        Process a raw PDF by injecting data at field locations.
+        
+        Args:
+            pdf_bytes: PDF binary
+            template: Template object with field definitions
+            data: Dictionary of field_key -> value to inject
+            
+        Returns:
+            Processed PDF as bytes
+        """
+        check_pdf_size(len(pdf_bytes))
+        
+        # PyMuPDF copies a bytearray stream but uses a memoryview in place
+        doc = fitz.open(stream=memoryview(pdf_bytes), filetype="pdf")
         
         try:
-            # Process each field
+            # Drop blank values once up front (blank fields allowed)
+            values = {
+                key: value for key, value in data.items()
+                if value is not None and value != ""
+            }
+            
+            # Group filled fields by page (0-indexed internally, 1-indexed
+            # in template) so each page is loaded and measured only once.
+            # Fields are flattened to tuples, with their injector already
+            # resolved, to keep model attribute access and type checks out
+            # of the injection loop.
+            injectors = self._INJECTORS
+            inject_text = type(self)._inject_text
+            fields_by_page: defaultdict[int, list[tuple]] = defaultdict(list)
             for field in template.fields:
-                value = data.get(field.key)
-                
-                # Skip if no value provided (blank fields allowed)
-                if value is None or value == "":
+                value = values.get(field.key)
+                if value is None:
                     continue
                 
-                # Get the page (0-indexed internally, 1-indexed in template)
-                page_index = field.page_number - 1
-                if page_index < 0 or page_index >= len(doc):
+                rect = field.rect
+                inject = injectors.get(field.type, inject_text)
+                fields_by_page[field.page_number - 1].append(
+                    (inject, rect.x, rect.y, rect.w, rect.h, value)
+                )
+            
+            page_count = doc.page_count
+            for page_index, fields in fields_by_page.items():
+                if page_index < 0 or page_index >= page_count:
                     continue
-                    
+                
                 page = doc[page_index]
                 page_rect = page.rect
+                page_width = page_rect.width
+                page_height = page_rect.height
                 
-                # Convert percentage coordinates to PDF coordinates
-                # PDF coordinates: origin is top-left in PyMuPDF
-                x0 = field.rect.x * page_rect.width
-                y0 = field.rect.y * page_rect.height
-                x1 = (field.rect.x + field.rect.w) * page_rect.width
-                y1 = (field.rect.y + field.rect.h) * page_rect.height
+                # Install the font once per page; later insert_textbox
+                # calls then resolve it straight from the page font list
+                font_xref = page.insert_font(fontname=self.font)
+                page_font = self._page_font_layout(doc, font_xref)
                 
-                # Create the text box rectangle
-                text_rect = fitz.Rect(x0, y0, x1, y1)
+                # Draw every field on one shape and commit it once, instead
+                # of rewriting the page contents after each field
+                shape = page.new_shape()
                 
-                # Handle different field types
-                if field.type == "checkbox":
-                    self._inject_checkbox(page, text_rect, bool(value))
-                elif field.type == "date":
-                    self._inject_date(page, text_rect, str(value))
-                else:  # text
-                    self._inject_text(page, text_rect, str(value))
+                for inject, x, y, w, h, value in fields:
+                    # Convert percentage coordinates to PDF coordinates
+                    # PDF coordinates: origin is top-left in PyMuPDF
+                    x0 = x * page_width
+                    y0 = y * page_height
+                    x1 = (x + w) * page_width
+                    y1 = (y + h) * page_height
+                    
+                    # Create the text box rectangle
+                    text_rect = fitz.Rect(x0, y0, x1, y1)
+                    
+                    inject(self, shape, text_rect, value, page_font)
+                
+                shape.commit()
             
             # Save to bytes
-            output = doc.tobytes()
+            output = self._save(doc)
             return output
             
         finally:
             doc.close()
     
-    def _inject_text(self, page: fitz.Page, rect: fitz.Rect, text: str) -> None:
+    def _page_font_layout(self, doc: fitz.Document, font_xref: int) -> tuple:
+        """
+        Measure the page's font the way insert_textbox does.
+        
+        The metrics come from the font object the page actually uses, which
+        for a PDF that already carries the font can differ from PyMuPDF's
+        built-in copy of it.
+        
+        Returns:
+            (ascender, line_extent, checkbox_markers), where line_extent is
+            the height one line needs per point of font size and
+            checkbox_markers maps checked -> (marker, width per point)
+        """
+        font_info = fitz.CheckFontInfo(doc, font_xref)[1]
+        ascender = font_info["ascender"]
+        descender = font_info["descender"]
+        line_height = ascender - descender
+        line_extent = (line_height if line_height > 1 else 1.2) - descender
+        
+        checkbox_markers = {}
+        for checked, marker in ((True, self.CHECKBOX_CHECKED), (False, self.CHECKBOX_UNCHECKED)):
+            # Simple fonts are single-byte and insert_textbox draws characters
+            # above 255 in them as "?"; substitute up front so insert_text
+            # draws the same and skips its wide glyph-width lookup
+            if font_info["simple"]:
+                marker = "".join("?" if ord(c) > 255 else c for c in marker)
+            if font_info["ordering"] < 0:
+                glyphs = doc.get_char_widths(font_xref, max(map(ord, marker)) + 1)
+                width = sum(glyphs[ord(c)][1] for c in marker)
+            else:
+                width = len(marker)
+            checkbox_markers[checked] = (marker, width)
+        
+        return ascender, line_extent, checkbox_markers
+    
+    @staticmethod
+    def _save(doc: fitz.Document) -> bytes:
+        """
+        Serialize the document, appending our edits as an incremental update.
+        
+        Only the objects touched while injecting are written after a copy of
+        the original bytes, so output cost scales with the number of fields
+        instead of the size of the source PDF. PyMuPDF only offers incremental
+        saves for file-backed documents, so this goes through its MuPDF
+        bindings and falls back to a full rewrite if that path fails.
+        """
+        if doc.can_save_incrementally():
+            try:
+                opts = fitz.mupdf.PdfWriteOptions()
+                opts.do_incremental = 1
+                buffer = io.BytesIO()
+                out = fitz.JM_new_output_fileptr(buffer)
+                try:
+                    fitz.mupdf.pdf_write_document(fitz._as_pdf_document(doc), out, opts)
+                finally:
+                    out.fz_close_output()
+                return buffer.getvalue()
+            except _INCREMENTAL_SAVE_ERRORS:
+                # These are PyMuPDF internals; fall back to a full rewrite
+                # rather than failing the request
+                logger.warning("Incremental save failed, rewriting PDF", exc_info=True)
+        
+        return doc.tobytes()
+    
+    def _inject_text(
+        self,
+        shape: fitz.Shape,
+        rect: fitz.Rect,
+        value: Any,
+        page_font: tuple,
+    ) -> None:
         """
         Inject text into a rectangular area with automatic wrapping.
         
         Uses insert_textbox for proper text wrapping within the field bounds.
         """
+        text = str(value)
+        
         # Calculate font size that fits the height if default is too big
-        fontsize = min(self.fontsize, rect.height * 0.8)
+        fontsize = rect.height * 0.8
+        max_fontsize = self.fontsize
+        if fontsize > max_fontsize:
+            fontsize = max_fontsize
         
-        page.insert_textbox(
+        shape.insert_textbox(
             rect,
             text,
             fontname=self.font,
@@ -127,41 +375,75 @@ class PDFProcessor:
             align=fitz.TEXT_ALIGN_LEFT,
         )
     
-    def _inject_date(self, page: fitz.Page, rect: fitz.Rect, date_str: str) -> None:
+    def _inject_date(
+        self,
+        shape: fitz.Shape,
+        rect: fitz.Rect,
+        value: Any,
+        page_font: tuple,
+    ) -> None:
         """
         Inject a date value, attempting to format it nicely.
         """
+        date_str = str(value)
+        
         # Try to parse and format the date
         formatted_date = date_str
-        try:
-            # Try ISO format first
-            dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            formatted_date = dt.strftime("%m/%d/%Y")
-        except (ValueError, AttributeError):
-            # Keep original if parsing fails
-            pass
         
-        self._inject_text(page, rect, formatted_date)
+        # Only values shaped like YYYY-MM-DD... are worth an ISO parse
+        if len(date_str) >= 10 and date_str[4] == "-" and date_str[7] == "-":
+            iso_str = date_str
+            if not _ISO_PARSES_Z and iso_str.endswith("Z"):
+                iso_str = iso_str[:-1] + "+00:00"
+            try:
+                dt = datetime.fromisoformat(iso_str)
+                formatted_date = dt.strftime("%m/%d/%Y")
+            except ValueError:
+                # Keep original if parsing fails
+                pass
+        
+        self._inject_text(shape, rect, formatted_date, page_font)
     
-    def _inject_checkbox(self, page: fitz.Page, rect: fitz.Rect, checked: bool) -> None:
+    def _inject_checkbox(
+        self,
+        shape: fitz.Shape,
+        rect: fitz.Rect,
+        value: Any,
+        page_font: tuple,
+    ) -> None:
         """
         Inject a checkbox marker.
         
         Uses Unicode checkbox characters centered in the field.
         """
-        marker = self.CHECKBOX_CHECKED if checked else self.CHECKBOX_UNCHECKED
+        ascender, line_extent, checkbox_markers = page_font
+        marker, marker_width = checkbox_markers[bool(value)]
         
         # Center the checkbox marker
-        fontsize = min(rect.height * 0.9, rect.width * 0.9)
+        fontsize = rect.height * 0.9
+        width_fontsize = rect.width * 0.9
+        if width_fontsize < fontsize:
+            fontsize = width_fontsize
         
-        page.insert_textbox(
-            rect,
+        # A single glyph needs no wrapping, so place it directly where
+        # insert_textbox would: centered on the first line of the box.
+        # Like insert_textbox, draw nothing if that line does not fit.
+        if fontsize * line_extent > rect.height:
+            return
+        
+        shape.insert_text(
+            (rect.x0 + (rect.width - marker_width * fontsize) / 2, rect.y0 + fontsize * ascender),
             marker,
             fontname=self.font,
             fontsize=fontsize,
             color=self.text_color,
-            align=fitz.TEXT_ALIGN_CENTER,
         )
+    
+    # Field type -> injector; any other type is injected as text
+    _INJECTORS = {
+        "checkbox": _inject_checkbox,
+        "date": _inject_date,
+    }
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -173,3 +455,4 @@ if __name__ == "__main__":
     # Test with a sample PDF
     print("PDF Processor initialized successfully")
     print(f"PyMuPDF version: {fitz.version}")
+    print(f"base64 backend: {_base64.__name__}")